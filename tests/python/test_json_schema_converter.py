@@ -1,24 +1,89 @@
+import functools
 import json
 import sys
 from enum import Enum
-from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple, Type, Union
+from typing import Annotated, Any, Callable, Dict, List, Literal, Optional, Tuple, Type, Union
 
 import pytest
 from pydantic import BaseModel, Field, TypeAdapter, WithJsonSchema, create_model
 
 import xgrammar as xgr
-from xgrammar.testing import _generate_range_regex, _is_grammar_accept_string, _json_schema_to_ebnf
+from xgrammar.testing import _generate_range_regex, _json_schema_to_ebnf
+
+# The basic rules shared by every grammar generated from a JSON schema
+_BASIC_RULES = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
+basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
+basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
+basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
+basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
+basic_string ::= ["] basic_string_sub
+basic_boolean ::= "true" | "false"
+basic_null ::= "null"
+"""
+
+# The basic array and object rules when any_whitespace=False, in strict and non-strict mode
+_BASIC_PRELUDE = (
+    _BASIC_RULES
+    + r"""basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
+basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
+"""
+)
+_BASIC_PRELUDE_NONSTRICT = (
+    _BASIC_RULES
+    + r"""basic_array ::= ("[" "" basic_any (", " basic_any)* "" "]") | "[" "]"
+basic_object ::= ("{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}") | "{" "}"
+"""
+)
+
+
+# Shared by all tests in this module. Compiled grammars are reused through _cached_matcher
+_grammar_compiler = xgr.GrammarCompiler(xgr.TokenizerInfo([]), cache_enabled=False)
+
+
+def _make_matcher(compiled_grammar: xgr.CompiledGrammar) -> Callable[[str], bool]:
+    """Create a matcher once and return a function checking if it accepts a string."""
+    matcher = xgr.GrammarMatcher(compiled_grammar, terminate_without_stop_token=True)
+
+    def match(instance: str) -> bool:
+        matcher.reset()
+        return matcher._debug_accept_string(instance) and matcher.is_terminated()
+
+    return match
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_matcher(
+    schema_str: str,
+    any_whitespace: bool,
+    indent: Optional[int],
+    separators: Optional[Tuple[str, str]],
+    strict_mode: bool,
+) -> Callable[[str], bool]:
+    compiled_grammar = _grammar_compiler.compile_json_schema(
+        schema_str,
+        any_whitespace=any_whitespace,
+        indent=indent,
+        separators=separators,
+        strict_mode=strict_mode,
+    )
+    return _make_matcher(compiled_grammar)
+
+
+def _dump_schema(schema: Dict[str, Any]) -> str:
+    # Keys are not sorted: the order of properties decides the order of fields in the grammar
+    return json.dumps(schema)
 
 
 def check_schema_with_grammar(
-    schema: Dict[str, Any],
+    schema: Union[Dict[str, Any], str],
     expected_grammar_ebnf: str,
     any_whitespace: bool = True,
     indent: Optional[int] = None,
     separators: Optional[Tuple[str, str]] = None,
     strict_mode: bool = True,
 ):
-    schema_str = json.dumps(schema)
+    # schema: json schema dict, or its json string (used as is) when a test checks it several times
+    schema_str = schema if isinstance(schema, str) else _dump_schema(schema)
     json_schema_ebnf = _json_schema_to_ebnf(
         schema_str,
         any_whitespace=any_whitespace,
@@ -30,7 +95,7 @@ def check_schema_with_grammar(
 
 
 def check_schema_with_instance(
-    schema: Dict[str, Any],
+    schema: Union[Dict[str, Any], str],
     instance: Union[str, BaseModel, Any],
     is_accepted: bool = True,
     any_whitespace: bool = True,
@@ -38,13 +103,12 @@ def check_schema_with_instance(
     separators: Optional[Tuple[str, str]] = None,
     strict_mode: bool = True,
 ):
-    json_schema_grammar = xgr.Grammar.from_json_schema(
-        json.dumps(schema),
-        any_whitespace=any_whitespace,
-        indent=indent,
-        separators=separators,
-        strict_mode=strict_mode,
-    )
+    # The same schema is usually checked against several instances, so reuse the grammar and
+    # its matcher
+    schema_str = schema if isinstance(schema, str) else _dump_schema(schema)
+    if separators is not None:
+        separators = tuple(separators)
+    match = _cached_matcher(schema_str, any_whitespace, indent, separators, strict_mode)
 
     # instance: pydantic model, json string, or any other object (dumped to json string)
     if isinstance(instance, BaseModel):
@@ -55,9 +119,23 @@ def check_schema_with_instance(
         instance = json.dumps(instance, indent=indent, separators=separators)
 
     if is_accepted:
-        assert _is_grammar_accept_string(json_schema_grammar, instance)
+        assert match(instance)
     else:
-        assert not _is_grammar_accept_string(json_schema_grammar, instance)
+        assert not match(instance)
+
+
+_EBNF_BASIC = (
+    _BASIC_PRELUDE
+    + r"""root_prop_3 ::= "[" "" basic_any (", " basic_any)* "" "]"
+root_prop_4 ::= "[" "" basic_string (", " basic_string)* "" "]"
+root_prop_5_item_2 ::= "[" "" basic_string (", " basic_string)* "" "]"
+root_prop_5 ::= "[" "" basic_string ", " basic_integer ", " root_prop_5_item_2 "" "]"
+root_prop_6 ::= "{" "" basic_string ": " basic_integer (", " basic_string ": " basic_integer)* "" "}"
+root_prop_7_addl ::= "{" "" basic_string ": " basic_integer (", " basic_string ": " basic_integer)* "" "}"
+root_prop_7 ::= "{" "" basic_string ": " root_prop_7_addl (", " basic_string ": " root_prop_7_addl)* "" "}"
+root ::= "{" "" "\"integer_field\"" ": " basic_integer ", " "\"number_field\"" ": " basic_number ", " "\"boolean_field\"" ": " basic_boolean ", " "\"any_array_field\"" ": " root_prop_3 ", " "\"array_field\"" ": " root_prop_4 ", " "\"tuple_field\"" ": " root_prop_5 ", " "\"object_field\"" ": " root_prop_6 ", " "\"nested_object_field\"" ": " root_prop_7 "" "}"
+"""
+)
 
 
 def test_basic():
@@ -71,28 +149,8 @@ def test_basic():
         object_field: Dict[str, int]
         nested_object_field: Dict[str, Dict[str, int]]
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_prop_3 ::= "[" "" basic_any (", " basic_any)* "" "]"
-root_prop_4 ::= "[" "" basic_string (", " basic_string)* "" "]"
-root_prop_5_item_2 ::= "[" "" basic_string (", " basic_string)* "" "]"
-root_prop_5 ::= "[" "" basic_string ", " basic_integer ", " root_prop_5_item_2 "" "]"
-root_prop_6 ::= "{" "" basic_string ": " basic_integer (", " basic_string ": " basic_integer)* "" "}"
-root_prop_7_addl ::= "{" "" basic_string ": " basic_integer (", " basic_string ": " basic_integer)* "" "}"
-root_prop_7 ::= "{" "" basic_string ": " root_prop_7_addl (", " basic_string ": " root_prop_7_addl)* "" "}"
-root ::= "{" "" "\"integer_field\"" ": " basic_integer ", " "\"number_field\"" ": " basic_number ", " "\"boolean_field\"" ": " basic_boolean ", " "\"any_array_field\"" ": " root_prop_3 ", " "\"array_field\"" ": " root_prop_4 ", " "\"tuple_field\"" ": " root_prop_5 ", " "\"object_field\"" ": " root_prop_6 ", " "\"nested_object_field\"" ": " root_prop_7 "" "}"
-"""
-
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_BASIC, any_whitespace=False)
 
     instance = MainModel(
         integer_field=42,
@@ -116,33 +174,25 @@ root ::= "{" "" "\"integer_field\"" ": " basic_integer ", " "\"number_field\"" "
         object_field={},
         nested_object_field={},
     )
-
-    schema = MainModel.model_json_schema()
     check_schema_with_instance(schema, instance_empty, is_accepted=False, any_whitespace=False)
 
 
-def test_indent():
-    class MainModel(BaseModel):
-        array_field: List[str]
-        tuple_field: Tuple[str, int, List[str]]
-        object_field: Dict[str, int]
-
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_prop_0 ::= "[" "\n    " basic_string (",\n    " basic_string)* "\n  " "]"
+_EBNF_INDENT = (
+    _BASIC_PRELUDE
+    + r"""root_prop_0 ::= "[" "\n    " basic_string (",\n    " basic_string)* "\n  " "]"
 root_prop_1_item_2 ::= "[" "\n      " basic_string (",\n      " basic_string)* "\n    " "]"
 root_prop_1 ::= "[" "\n    " basic_string ",\n    " basic_integer ",\n    " root_prop_1_item_2 "\n  " "]"
 root_prop_2 ::= "{" "\n    " basic_string ": " basic_integer (",\n    " basic_string ": " basic_integer)* "\n  " "}"
 root ::= "{" "\n  " "\"array_field\"" ": " root_prop_0 ",\n  " "\"tuple_field\"" ": " root_prop_1 ",\n  " "\"object_field\"" ": " root_prop_2 "\n" "}"
 """
+)
+
+
+def test_indent():
+    class MainModel(BaseModel):
+        array_field: List[str]
+        tuple_field: Tuple[str, int, List[str]]
+        object_field: Dict[str, int]
 
     instance = MainModel(
         array_field=["foo", "bar"],
@@ -150,14 +200,26 @@ root ::= "{" "\n  " "\"array_field\"" ": " root_prop_0 ",\n  " "\"tuple_field\""
         object_field={"foo": 42, "bar": 43},
     )
 
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False, indent=2)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_INDENT, any_whitespace=False, indent=2)
     check_schema_with_instance(schema, instance, any_whitespace=False, indent=2)
     check_schema_with_instance(
         schema, instance, any_whitespace=False, indent=None, separators=(",", ":")
     )
 
 
+_EBNF_NON_STRICT = (
+    _BASIC_PRELUDE_NONSTRICT
+    + r"""root_prop_0_item_1 ::= "[" "\n      " basic_integer ",\n      " basic_integer (",\n      " basic_any)* "\n    " "]"
+root_prop_0 ::= "[" "\n    " basic_string ",\n    " root_prop_0_item_1 (",\n    " basic_any)* "\n  " "]"
+defs_Foo ::= ("{" "\n    " basic_string ": " basic_any (",\n    " basic_string ": " basic_any)* "\n  " "}") | "{" "}"
+root_prop_1 ::= defs_Foo
+root_prop_2 ::= ("[" "\n    " basic_string (",\n    " basic_string)* "\n  " "]") | "[" "]"
+root ::= "{" "\n  " "\"tuple_field\"" ": " root_prop_0 ",\n  " "\"foo_field\"" ": " root_prop_1 ",\n  " "\"list_field\"" ": " root_prop_2 ",\n  " "\"object_field\"" ": " basic_object (",\n  " basic_string ": " basic_any)* "\n" "}"
+"""
+)
+
+
 def test_non_strict():
     class Foo(BaseModel):
         pass
@@ -168,24 +230,6 @@ def test_non_strict():
         list_field: List[str]
         object_field: Dict[str, Any]
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= ("[" "" basic_any (", " basic_any)* "" "]") | "[" "]"
-basic_object ::= ("{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}") | "{" "}"
-root_prop_0_item_1 ::= "[" "\n      " basic_integer ",\n      " basic_integer (",\n      " basic_any)* "\n    " "]"
-root_prop_0 ::= "[" "\n    " basic_string ",\n    " root_prop_0_item_1 (",\n    " basic_any)* "\n  " "]"
-defs_Foo ::= ("{" "\n    " basic_string ": " basic_any (",\n    " basic_string ": " basic_any)* "\n  " "}") | "{" "}"
-root_prop_1 ::= defs_Foo
-root_prop_2 ::= ("[" "\n    " basic_string (",\n    " basic_string)* "\n  " "]") | "[" "]"
-root ::= "{" "\n  " "\"tuple_field\"" ": " root_prop_0 ",\n  " "\"foo_field\"" ": " root_prop_1 ",\n  " "\"list_field\"" ": " root_prop_2 ",\n  " "\"object_field\"" ": " basic_object (",\n  " basic_string ": " basic_any)* "\n" "}"
-"""
-
     instance_json = r"""{
   "tuple_field": [
     "foo",
@@ -204,15 +248,28 @@ root ::= "{" "\n  " "\"tuple_field\"" ": " root_prop_0 ",\n  " "\"foo_field\"" "
   "extra": "field"
 }"""
 
-    schema = MainModel.model_json_schema()
+    schema = _dump_schema(MainModel.model_json_schema())
     check_schema_with_grammar(
-        schema, ebnf_grammar, any_whitespace=False, indent=2, strict_mode=False
+        schema, _EBNF_NON_STRICT, any_whitespace=False, indent=2, strict_mode=False
     )
     check_schema_with_instance(
         schema, instance_json, any_whitespace=False, indent=2, strict_mode=False
     )
 
 
+_EBNF_ENUM_CONST = (
+    _BASIC_PRELUDE
+    + r"""root_prop_0 ::= "\"a\""
+root_prop_1 ::= "\"a\\n\\r\\\"\""
+root_prop_2 ::= ("\"a\"") | ("\"b\"") | ("\"c\"")
+root_prop_3 ::= ("1") | ("\"a\"") | ("true")
+defs_Field ::= ("\"foo\"") | ("\"bar\"")
+root_prop_4 ::= defs_Field
+root ::= "{" "" "\"bars\"" ": " root_prop_0 ", " "\"str_values\"" ": " root_prop_1 ", " "\"foo\"" ": " root_prop_2 ", " "\"values\"" ": " root_prop_3 ", " "\"field\"" ": " root_prop_4 "" "}"
+"""
+)
+
+
 def test_enum_const():
     class Field(Enum):
         FOO = "foo"
@@ -225,31 +282,21 @@ def test_enum_const():
         values: Literal[1, "a", True]
         field: Field
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_prop_0 ::= "\"a\""
-root_prop_1 ::= "\"a\\n\\r\\\"\""
-root_prop_2 ::= ("\"a\"") | ("\"b\"") | ("\"c\"")
-root_prop_3 ::= ("1") | ("\"a\"") | ("true")
-defs_Field ::= ("\"foo\"") | ("\"bar\"")
-root_prop_4 ::= defs_Field
-root ::= "{" "" "\"bars\"" ": " root_prop_0 ", " "\"str_values\"" ": " root_prop_1 ", " "\"foo\"" ": " root_prop_2 ", " "\"values\"" ": " root_prop_3 ", " "\"field\"" ": " root_prop_4 "" "}"
-"""
-
-    schema = MainModel.model_json_schema()
+    schema = _dump_schema(MainModel.model_json_schema())
     instance = MainModel(foo="a", values=1, bars="a", str_values='a\n\r"', field=Field.FOO)
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    check_schema_with_grammar(schema, _EBNF_ENUM_CONST, any_whitespace=False)
     check_schema_with_instance(schema, instance, any_whitespace=False)
 
 
+_EBNF_OPTIONAL = (
+    _BASIC_PRELUDE
+    + r"""root_prop_1 ::= basic_boolean | basic_null
+root_prop_2 ::= basic_number | basic_null
+root ::= "{" "" ("\"num\"" ": " basic_integer ", ")? ("\"opt_bool\"" ": " root_prop_1 ", ")? "\"size\"" ": " root_prop_2 (", " "\"name\"" ": " basic_string)? "" "}"
+"""
+)
+
+
 def test_optional():
     class MainModel(BaseModel):
         num: int = 0
@@ -257,23 +304,8 @@ def test_optional():
         size: Optional[float]
         name: str = ""
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_prop_1 ::= basic_boolean | basic_null
-root_prop_2 ::= basic_number | basic_null
-root ::= "{" "" ("\"num\"" ": " basic_integer ", ")? ("\"opt_bool\"" ": " root_prop_1 ", ")? "\"size\"" ": " root_prop_2 (", " "\"name\"" ": " basic_string)? "" "}"
-"""
-
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_OPTIONAL, any_whitespace=False)
 
     instance = MainModel(num=42, opt_bool=True, size=3.14, name="foo")
     check_schema_with_instance(schema, instance, any_whitespace=False)
@@ -288,29 +320,32 @@ root ::= "{" "" ("\"num\"" ": " basic_integer ", ")? ("\"opt_bool\"" ": " root_p
     )
 
 
+_EBNF_ALL_OPTIONAL = (
+    _BASIC_PRELUDE
+    + r"""root_part_1 ::= "" | ", " "\"num\"" ": " basic_number ""
+root_part_0 ::= root_part_1 | ", " "\"state\"" ": " basic_boolean root_part_1
+root ::= "{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ": " basic_boolean root_part_1) | ("\"num\"" ": " basic_number "")) "" "}"
+"""
+)
+
+_EBNF_ALL_OPTIONAL_NON_STRICT = (
+    _BASIC_PRELUDE_NONSTRICT
+    + r"""root_part_2 ::= (", " basic_string ": " basic_any)*
+root_part_1 ::= root_part_2 | ", " "\"num\"" ": " basic_number root_part_2
+root_part_0 ::= root_part_1 | ", " "\"state\"" ": " basic_boolean root_part_1
+root ::= ("{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ": " basic_boolean root_part_1) | ("\"num\"" ": " basic_number root_part_2) | basic_string ": " basic_any root_part_2) "" "}") | "{" "}"
+"""
+)
+
+
 def test_all_optional():
     class MainModel(BaseModel):
         size: int = 0
         state: bool = False
         num: float = 0
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_part_1 ::= "" | ", " "\"num\"" ": " basic_number ""
-root_part_0 ::= root_part_1 | ", " "\"state\"" ": " basic_boolean root_part_1
-root ::= "{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ": " basic_boolean root_part_1) | ("\"num\"" ": " basic_number "")) "" "}"
-"""
-
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_ALL_OPTIONAL, any_whitespace=False)
 
     instance = MainModel(size=42, state=True, num=3.14)
     check_schema_with_instance(schema, instance, any_whitespace=False)
@@ -318,24 +353,8 @@ root ::= "{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ": "
     check_schema_with_instance(schema, '{"state": false}', any_whitespace=False)
     check_schema_with_instance(schema, '{"size": 1, "num": 1.5}', any_whitespace=False)
 
-    ebnf_grammar_non_strict = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= ("[" "" basic_any (", " basic_any)* "" "]") | "[" "]"
-basic_object ::= ("{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}") | "{" "}"
-root_part_2 ::= (", " basic_string ": " basic_any)*
-root_part_1 ::= root_part_2 | ", " "\"num\"" ": " basic_number root_part_2
-root_part_0 ::= root_part_1 | ", " "\"state\"" ": " basic_boolean root_part_1
-root ::= ("{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ": " basic_boolean root_part_1) | ("\"num\"" ": " basic_number root_part_2) | basic_string ": " basic_any root_part_2) "" "}") | "{" "}"
-"""
-
     check_schema_with_grammar(
-        schema, ebnf_grammar_non_strict, any_whitespace=False, strict_mode=False
+        schema, _EBNF_ALL_OPTIONAL_NON_STRICT, any_whitespace=False, strict_mode=False
     )
 
     check_schema_with_instance(
@@ -344,25 +363,19 @@ root ::= ("{" "" (("\"size\"" ": " basic_integer root_part_0) | ("\"state\"" ":
     check_schema_with_instance(schema, '{"other": false}', any_whitespace=False, strict_mode=False)
 
 
+_EBNF_EMPTY = (
+    _BASIC_PRELUDE
+    + r"""root ::= "{" "}"
+"""
+)
+
+
 def test_empty():
     class MainModel(BaseModel):
         pass
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root ::= "{" "}"
-"""
-
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_EMPTY, any_whitespace=False)
 
     instance = MainModel()
     check_schema_with_instance(schema, instance, any_whitespace=False)
@@ -370,6 +383,20 @@ root ::= "{" "}"
     check_schema_with_instance(schema, '{"tmp": 123}', any_whitespace=False, strict_mode=False)
 
 
+_EBNF_REFERENCE = (
+    _BASIC_PRELUDE
+    + r"""defs_Foo_prop_1 ::= basic_number | basic_null
+defs_Foo ::= "{" "" "\"count\"" ": " basic_integer (", " "\"size\"" ": " defs_Foo_prop_1)? "" "}"
+root_prop_0 ::= defs_Foo
+defs_Bar_part_0 ::= "" | ", " "\"banana\"" ": " basic_string ""
+defs_Bar ::= "{" "" (("\"apple\"" ": " basic_string defs_Bar_part_0) | ("\"banana\"" ": " basic_string "")) "" "}"
+root_prop_1_items ::= defs_Bar
+root_prop_1 ::= "[" "" root_prop_1_items (", " root_prop_1_items)* "" "]"
+root ::= "{" "" "\"foo\"" ": " root_prop_0 ", " "\"bars\"" ": " root_prop_1 "" "}"
+"""
+)
+
+
 def test_reference():
     class Foo(BaseModel):
         count: int
@@ -387,363 +414,287 @@ def test_reference():
         foo=Foo(count=42, size=3.14), bars=[Bar(apple="a", banana="b"), Bar(apple="c", banana="d")]
     )
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-defs_Foo_prop_1 ::= basic_number | basic_null
-defs_Foo ::= "{" "" "\"count\"" ": " basic_integer (", " "\"size\"" ": " defs_Foo_prop_1)? "" "}"
-root_prop_0 ::= defs_Foo
-defs_Bar_part_0 ::= "" | ", " "\"banana\"" ": " basic_string ""
-defs_Bar ::= "{" "" (("\"apple\"" ": " basic_string defs_Bar_part_0) | ("\"banana\"" ": " basic_string "")) "" "}"
-root_prop_1_items ::= defs_Bar
-root_prop_1 ::= "[" "" root_prop_1_items (", " root_prop_1_items)* "" "]"
-root ::= "{" "" "\"foo\"" ": " root_prop_0 ", " "\"bars\"" ": " root_prop_1 "" "}"
-"""
-
-    schema = MainModel.model_json_schema()
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+    check_schema_with_grammar(schema, _EBNF_REFERENCE, any_whitespace=False)
     check_schema_with_instance(schema, instance, any_whitespace=False)
 
 
-def test_reference_schema():
-    # Test simple reference with $defs
-    schema = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/$defs/nested"}},
-        "required": ["value"],
-        "$defs": {
-            "nested": {
-                "type": "object",
-                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-                "required": ["name", "age"],
+# Simple reference with $defs
+schema_ref_defs = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/$defs/nested"}},
+    "required": ["value"],
+    "$defs": {
+        "nested": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+            "required": ["name", "age"],
+        }
+    },
+}
+
+# Simple reference with definitions
+schema_ref_definitions = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/definitions/nested"}},
+    "required": ["value"],
+    "definitions": {
+        "nested": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+            "required": ["name", "age"],
+        }
+    },
+}
+
+# Multi-level reference path
+schema_ref_multi_level = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/$defs/level1/level2/nested"}},
+    "required": ["value"],
+    "$defs": {
+        "level1": {
+            "level2": {
+                "nested": {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                    "required": ["name", "age"],
+                }
             }
+        }
+    },
+}
+
+# Nested reference
+schema_ref_nested = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/definitions/node_a"}},
+    "required": ["value"],
+    "definitions": {
+        "node_a": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "child": {"$ref": "#/definitions/node_b"}},
+            "required": ["name"],
         },
-    }
-
-    instance = {"value": {"name": "John", "age": 30}}
-    instance_rejected = {"value": {"name": "John"}}
-
-    check_schema_with_instance(schema, instance, any_whitespace=False)
-    check_schema_with_instance(schema, instance_rejected, is_accepted=False, any_whitespace=False)
-
-    # Test simple reference with definitions
-    schema_def = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/definitions/nested"}},
-        "required": ["value"],
-        "definitions": {
-            "nested": {
-                "type": "object",
-                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-                "required": ["name", "age"],
-            }
+        "node_b": {"type": "object", "properties": {"id": {"type": "integer"}}, "required": ["id"]},
+    },
+}
+
+# Self-recursion through $defs
+schema_ref_self_recursive = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/$defs/node"}},
+    "required": ["value"],
+    "$defs": {
+        "node": {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}, "next": {"$ref": "#/$defs/node"}},
+            "required": ["id"],
+        }
+    },
+}
+
+# Circular references between multiple schemas
+schema_ref_circular = {
+    "type": "object",
+    "properties": {"value": {"$ref": "#/$defs/schema_a"}},
+    "required": ["value"],
+    "$defs": {
+        "schema_a": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "next": {"$ref": "#/$defs/schema_b"}},
+            "required": ["name", "next"],
         },
-    }
-
-    check_schema_with_instance(schema_def, instance, any_whitespace=False)
-    check_schema_with_instance(
-        schema_def, instance_rejected, is_accepted=False, any_whitespace=False
-    )
-
-    # Test multi-level reference path
-    schema_multi = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/$defs/level1/level2/nested"}},
-        "required": ["value"],
-        "$defs": {
-            "level1": {
-                "level2": {
-                    "nested": {
-                        "type": "object",
-                        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-                        "required": ["name", "age"],
-                    }
-                }
-            }
+        "schema_b": {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}, "child": {"$ref": "#/$defs/schema_a"}},
+            "required": ["id"],
         },
-    }
+    },
+}
+
+# Self-referential schema
+schema_ref_recursive = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "children": {"type": "array", "items": {"$ref": "#"}},
+    },
+    "required": ["name"],
+}
+
+
+def _circular_instance(names: List[str]) -> Dict[str, Any]:
+    """Build an instance of schema_ref_circular from the leaf up: schema_a nodes named by names,
+    linked by schema_b nodes with increasing ids."""
+    node: Dict[str, Any] = {"id": len(names)}
+    for i in reversed(range(len(names))):
+        node = {"name": names[i], "next": node}
+        if i > 0:
+            node = {"id": i, "child": node}
+    return {"value": node}
+
+
+instance_circular_complex = json.dumps(
+    _circular_instance(["root", "level1", "level2", "level3", "level4"])
+)
+
+reference_schema_instance_accepted = [
+    (schema_ref_defs, '{"value": {"name": "John", "age": 30}}', True),
+    (schema_ref_defs, '{"value": {"name": "John"}}', False),
+    (schema_ref_definitions, '{"value": {"name": "John", "age": 30}}', True),
+    (schema_ref_definitions, '{"value": {"name": "John"}}', False),
+    (schema_ref_multi_level, '{"value": {"name": "John", "age": 30}}', True),
+    (schema_ref_multi_level, '{"value": {"name": "John"}}', False),
+    (schema_ref_nested, '{"value": {"name": "first", "child": {"id": 1}}}', True),
+    (schema_ref_nested, '{"value": {"name": "first", "child": {}}}', False),
+    (schema_ref_self_recursive, '{"value": {"id": 1, "next": {"id": 2, "next": {"id": 3}}}}', True),
+    (schema_ref_self_recursive, '{"value": {"id": 1}}', True),
+    (schema_ref_self_recursive, '{"value": {"id": 1, "next": {"next": {"id": 3}}}}', False),
+    (
+        schema_ref_circular,
+        '{"value": {"name": "first", "next": {"id": 1, "child": {"name": "second", '
+        '"next": {"id": 2}}}}}',
+        True,
+    ),
+    (schema_ref_circular, instance_circular_complex, True),
+    (
+        schema_ref_circular,
+        '{"value": {"name": "first", "next": {"child": {"name": "second", "next": {"id": 2}}}}}',
+        False,
+    ),
+    (
+        schema_ref_recursive,
+        '{"name": "root", "children": [{"name": "child1", "children": [{"name": "grandchild1"}]}, '
+        '{"name": "child2"}]}',
+        True,
+    ),
+    (schema_ref_recursive, '{"children": [{"name": "child1"}]}', False),
+]
+
+
+@pytest.mark.parametrize("schema, instance, is_accepted", reference_schema_instance_accepted)
+def test_reference_schema(schema: Dict[str, Any], instance: str, is_accepted: bool):
+    check_schema_with_instance(schema, instance, is_accepted=is_accepted, any_whitespace=False)
+
+
+_EBNF_UNION = (
+    _BASIC_PRELUDE
+    + r"""defs_Cat ::= "{" "" "\"name\"" ": " basic_string ", " "\"color\"" ": " basic_string "" "}"
+root_case_0 ::= defs_Cat
+defs_Dog ::= "{" "" "\"name\"" ": " basic_string ", " "\"breed\"" ": " basic_string "" "}"
+root_case_1 ::= defs_Dog
+root ::= root_case_0 | root_case_1
+"""
+)
 
-    check_schema_with_instance(schema_multi, instance, any_whitespace=False)
-    check_schema_with_instance(
-        schema_multi, instance_rejected, is_accepted=False, any_whitespace=False
-    )
 
-    # Test nested reference
-    schema_nested = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/definitions/node_a"}},
-        "required": ["value"],
-        "definitions": {
-            "node_a": {
-                "type": "object",
-                "properties": {
-                    "name": {"type": "string"},
-                    "child": {"$ref": "#/definitions/node_b"},
-                },
-                "required": ["name"],
-            },
-            "node_b": {
-                "type": "object",
-                "properties": {"id": {"type": "integer"}},
-                "required": ["id"],
-            },
-        },
-    }
+class Cat(BaseModel):
+    name: str
+    color: str
 
-    instance_nested = {"value": {"name": "first", "child": {"id": 1}}}
-    instance_nested_rejected = {"value": {"name": "first", "child": {}}}
 
-    check_schema_with_instance(schema_nested, instance_nested, any_whitespace=False)
-    check_schema_with_instance(
-        schema_nested, instance_nested_rejected, is_accepted=False, any_whitespace=False
-    )
+class Dog(BaseModel):
+    name: str
+    breed: str
 
-    # Test schema with self-recursion through $defs
-    schema_self_recursive = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/$defs/node"}},
-        "required": ["value"],
-        "$defs": {
-            "node": {
-                "type": "object",
-                "properties": {"id": {"type": "integer"}, "next": {"$ref": "#/$defs/node"}},
-                "required": ["id"],
-            }
-        },
-    }
 
-    instance_self_recursive = {"value": {"id": 1, "next": {"id": 2, "next": {"id": 3}}}}
-    instance_self_recursive_1 = {"value": {"id": 1}}
-    instance_self_recursive_rejected = {"value": {"id": 1, "next": {"next": {"id": 3}}}}
+union_adapter = TypeAdapter(Union[Cat, Dog])
 
-    check_schema_with_instance(schema_self_recursive, instance_self_recursive, any_whitespace=False)
-    check_schema_with_instance(
-        schema_self_recursive, instance_self_recursive_1, any_whitespace=False
-    )
-    check_schema_with_instance(
-        schema_self_recursive,
-        instance_self_recursive_rejected,
-        is_accepted=False,
-        any_whitespace=False,
-    )
 
-    # Test schema with circular references between multiple schemas
-    schema_circular = {
-        "type": "object",
-        "properties": {"value": {"$ref": "#/$defs/schema_a"}},
-        "required": ["value"],
-        "$defs": {
-            "schema_a": {
-                "type": "object",
-                "properties": {"name": {"type": "string"}, "next": {"$ref": "#/$defs/schema_b"}},
-                "required": ["name", "next"],
-            },
-            "schema_b": {
-                "type": "object",
-                "properties": {"id": {"type": "integer"}, "child": {"$ref": "#/$defs/schema_a"}},
-                "required": ["id"],
-            },
-        },
-    }
+def test_union():
+    model_schema = _dump_schema(union_adapter.json_schema())
 
-    instance_circular = {
-        "value": {
-            "name": "first",
-            "next": {"id": 1, "child": {"name": "second", "next": {"id": 2}}},
-        }
-    }
-    instance_circular_complex = {
-        # fmt: off
-        "value": {"name": "root", "next": {
-            "id": 1, "child": {"name": "level1", "next": {
-                "id": 2, "child": {"name": "level2", "next": {
-                    "id": 3, "child": {"name": "level3", "next": {
-                        "id": 4, "child": {"name": "level4", "next": {"id": 5}}
-                    }}
-                }}
-            }}
-        }}
-        # fmt: on
-    }
-    instance_circular_rejected = {
-        "value": {"name": "first", "next": {"child": {"name": "second", "next": {"id": 2}}}}
-    }
+    check_schema_with_grammar(model_schema, _EBNF_UNION, any_whitespace=False)
 
-    check_schema_with_instance(schema_circular, instance_circular, any_whitespace=False)
-    check_schema_with_instance(schema_circular, instance_circular_complex, any_whitespace=False)
+    check_schema_with_instance(model_schema, Cat(name="kitty", color="black"), any_whitespace=False)
     check_schema_with_instance(
-        schema_circular, instance_circular_rejected, is_accepted=False, any_whitespace=False
+        model_schema, Dog(name="doggy", breed="bulldog"), any_whitespace=False
     )
-
-    # Test self-referential schema
-    schema_recursive = {
-        "type": "object",
-        "properties": {
-            "name": {"type": "string"},
-            "children": {"type": "array", "items": {"$ref": "#"}},
-        },
-        "required": ["name"],
-    }
-
-    instance_recursive = {
-        "name": "root",
-        "children": [{"name": "child1", "children": [{"name": "grandchild1"}]}, {"name": "child2"}],
-    }
-    instance_recursive_rejected = {"children": [{"name": "child1"}]}
-
-    check_schema_with_instance(schema_recursive, instance_recursive, any_whitespace=False)
     check_schema_with_instance(
-        schema_recursive, instance_recursive_rejected, is_accepted=False, any_whitespace=False
+        model_schema, '{"name": "kitty", "test": "black"}', False, any_whitespace=False
     )
 
 
-def test_union():
-    class Cat(BaseModel):
-        name: str
-        color: str
+schema_anyof = {
+    "type": "object",
+    "properties": {"name": {"anyOf": [{"type": "string"}, {"type": "integer"}]}},
+}
 
-    class Dog(BaseModel):
-        name: str
-        breed: str
+schema_oneof = {
+    "type": "object",
+    "properties": {"name": {"oneOf": [{"type": "string"}, {"type": "integer"}]}},
+}
 
-    ta = TypeAdapter(Union[Cat, Dog])
+anyof_oneof_schema_instance_accepted = [
+    (schema_anyof, '{"name": "John"}', True),
+    (schema_anyof, '{"name": 123}', True),
+    (schema_anyof, '{"name": {"a": 1}}', False),
+    (schema_oneof, '{"name": "John"}', True),
+    (schema_oneof, '{"name": 123}', True),
+    (schema_oneof, '{"name": {"a": 1}}', False),
+]
 
-    model_schema = ta.json_schema()
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-defs_Cat ::= "{" "" "\"name\"" ": " basic_string ", " "\"color\"" ": " basic_string "" "}"
-root_case_0 ::= defs_Cat
-defs_Dog ::= "{" "" "\"name\"" ": " basic_string ", " "\"breed\"" ": " basic_string "" "}"
-root_case_1 ::= defs_Dog
-root ::= root_case_0 | root_case_1
-"""
+@pytest.mark.parametrize("schema, instance, is_accepted", anyof_oneof_schema_instance_accepted)
+def test_anyof_oneof(schema: Dict[str, Any], instance: str, is_accepted: bool):
+    check_schema_with_instance(schema, instance, is_accepted=is_accepted, any_whitespace=False)
 
-    check_schema_with_grammar(model_schema, ebnf_grammar, any_whitespace=False)
 
-    check_schema_with_instance(model_schema, Cat(name="kitty", color="black"), any_whitespace=False)
-    check_schema_with_instance(
-        model_schema, Dog(name="doggy", breed="bulldog"), any_whitespace=False
-    )
-    check_schema_with_instance(
-        model_schema, '{"name": "kitty", "test": "black"}', False, any_whitespace=False
-    )
-
-
-def test_anyof_oneof():
-    schema = {
-        "type": "object",
-        "properties": {"name": {"anyOf": [{"type": "string"}, {"type": "integer"}]}},
-    }
-    schema_accepted_1 = '{"name": "John"}'
-    schema_accepted_2 = '{"name": 123}'
-    schema_rejected = '{"name": {"a": 1}}'
-    check_schema_with_instance(schema, schema_accepted_1, any_whitespace=False)
-    check_schema_with_instance(schema, schema_accepted_2, any_whitespace=False)
-    check_schema_with_instance(schema, schema_rejected, is_accepted=False, any_whitespace=False)
-
-    schema = {
-        "type": "object",
-        "properties": {"name": {"oneOf": [{"type": "string"}, {"type": "integer"}]}},
-    }
+_EBNF_ALIAS = (
+    _BASIC_PRELUDE
+    + r"""root ::= "{" "" "\"name\"" ": " basic_string "" "}"
+"""
+)
 
-    schema_accepted_1 = '{"name": "John"}'
-    schema_accepted_2 = '{"name": 123}'
-    schema_rejected = '{"name": {"a": 1}}'
-    check_schema_with_instance(schema, schema_accepted_1, any_whitespace=False)
-    check_schema_with_instance(schema, schema_accepted_2, any_whitespace=False)
-    check_schema_with_instance(schema, schema_rejected, is_accepted=False, any_whitespace=False)
+_EBNF_ALIAS_SPACE = (
+    _BASIC_PRELUDE
+    + r"""root_prop_0 ::= "\"abc\""
+root ::= "{" "" "\"name 1\"" ": " root_prop_0 "" "}"
+"""
+)
 
 
 def test_alias():
     class MainModel(BaseModel):
         test: str = Field(..., alias="name")
 
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root ::= "{" "" "\"name\"" ": " basic_string "" "}"
-"""
-
-    check_schema_with_grammar(MainModel.model_json_schema(), ebnf_grammar, any_whitespace=False)
+    # by_alias defaults to True in model_json_schema
+    schema_by_alias = _dump_schema(MainModel.model_json_schema(by_alias=True))
+    schema_no_alias = MainModel.model_json_schema(by_alias=False)
+    check_schema_with_grammar(schema_by_alias, _EBNF_ALIAS, any_whitespace=False)
 
     instance = MainModel(name="kitty")
     instance_str = json.dumps(instance.model_dump(mode="json", round_trip=True, by_alias=False))
-    check_schema_with_instance(
-        MainModel.model_json_schema(by_alias=False), instance_str, any_whitespace=False
-    )
+    check_schema_with_instance(schema_no_alias, instance_str, any_whitespace=False)
 
     instance_str = json.dumps(instance.model_dump(mode="json", round_trip=True, by_alias=True))
-    check_schema_with_instance(
-        MainModel.model_json_schema(by_alias=True), instance_str, any_whitespace=False
-    )
+    check_schema_with_instance(schema_by_alias, instance_str, any_whitespace=False)
 
     # property name contains space
     class MainModelSpace(BaseModel):
         test: Literal["abc"] = Field(..., alias="name 1")
 
-    ebnf_grammar_space = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" "" basic_any (", " basic_any)* "" "]"
-basic_object ::= "{" "" basic_string ": " basic_any (", " basic_string ": " basic_any)* "" "}"
-root_prop_0 ::= "\"abc\""
-root ::= "{" "" "\"name 1\"" ": " root_prop_0 "" "}"
-"""
-
-    check_schema_with_grammar(
-        MainModelSpace.model_json_schema(), ebnf_grammar_space, any_whitespace=False
-    )
+    schema_space = _dump_schema(MainModelSpace.model_json_schema(by_alias=True))
+    check_schema_with_grammar(schema_space, _EBNF_ALIAS_SPACE, any_whitespace=False)
 
     instance_space = MainModelSpace(**{"name 1": "abc"})
     instance_space_str = json.dumps(
         instance_space.model_dump(mode="json", round_trip=True, by_alias=True)
     )
-    check_schema_with_instance(
-        MainModelSpace.model_json_schema(by_alias=True), instance_space_str, any_whitespace=False
-    )
+    check_schema_with_instance(schema_space, instance_space_str, any_whitespace=False)
 
 
 def test_restricted_string():
     class MainModel(BaseModel):
         restricted_string: str = Field(..., pattern=r"[a-f]")
 
-    instance = MainModel(restricted_string="a")
-    instance_str = json.dumps(instance.model_dump(mode="json"))
-    check_schema_with_instance(MainModel.model_json_schema(), instance_str, any_whitespace=False)
+    schema = _dump_schema(MainModel.model_json_schema())
+
+    check_schema_with_instance(schema, '{"restricted_string": "a"}', any_whitespace=False)
 
     check_schema_with_instance(
-        MainModel.model_json_schema(),
-        '{"restricted_string": "j"}',
-        is_accepted=False,
-        any_whitespace=False,
+        schema, '{"restricted_string": "j"}', is_accepted=False, any_whitespace=False
     )
 
 
@@ -752,21 +703,22 @@ def test_complex_restrictions():
         restricted_string: Annotated[str, WithJsonSchema({"type": "string", "pattern": r"[^\"]*"})]
         restricted_value: Annotated[int, Field(strict=True, ge=0, lt=44)]
 
+    schema = _dump_schema(RestrictedModel.model_json_schema())
+
     # working instance
-    instance = RestrictedModel(restricted_string="abd", restricted_value=42)
-    instance_str = json.dumps(instance.model_dump(mode="json"))
     check_schema_with_instance(
-        RestrictedModel.model_json_schema(), instance_str, any_whitespace=False
+        schema, '{"restricted_string": "abd", "restricted_value": 42}', any_whitespace=False
     )
 
-    instance_err = RestrictedModel(restricted_string='"', restricted_value=42)
-    instance_str = json.dumps(instance_err.model_dump(mode="json"))
     check_schema_with_instance(
-        RestrictedModel.model_json_schema(), instance_str, is_accepted=False, any_whitespace=False
+        schema,
+        r'{"restricted_string": "\"", "restricted_value": 42}',
+        is_accepted=False,
+        any_whitespace=False,
     )
 
     check_schema_with_instance(
-        RestrictedModel.model_json_schema(),
+        schema,
         '{"restricted_string": "j", "restricted_value": 45}',
         is_accepted=False,
         any_whitespace=False,
@@ -794,47 +746,40 @@ def test_dynamic_model():
     )
 
 
-def test_any_whitespace():
-    class SimpleModel(BaseModel):
-        value: str
-        arr: List[int]
-        obj: Dict[str, int]
-
-    schema = SimpleModel.model_json_schema()
-
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= "[" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_any)* [ \n\t]* "]"
+_EBNF_ANY_WHITESPACE = (
+    _BASIC_RULES
+    + r"""basic_array ::= "[" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_any)* [ \n\t]* "]"
 basic_object ::= "{" [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any)* [ \n\t]* "}"
 root_prop_1 ::= "[" [ \n\t]* basic_integer ([ \n\t]* "," [ \n\t]* basic_integer)* [ \n\t]* "]"
 root_prop_2 ::= "{" [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_integer ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_integer)* [ \n\t]* "}"
 root ::= "{" [ \n\t]* "\"value\"" [ \n\t]* ":" [ \n\t]* basic_string [ \n\t]* "," [ \n\t]* "\"arr\"" [ \n\t]* ":" [ \n\t]* root_prop_1 [ \n\t]* "," [ \n\t]* "\"obj\"" [ \n\t]* ":" [ \n\t]* root_prop_2 [ \n\t]* "}"
 """
+)
 
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=True, strict_mode=True)
-
-    ebnf_grammar = r"""basic_escape ::= ["\\/bfnrt] | "u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]
-basic_string_sub ::= ("\"" | [^"\\\r\n] basic_string_sub | "\\" basic_escape basic_string_sub) (= [ \n\t]* [,}\]:])
-basic_any ::= basic_number | basic_string | basic_boolean | basic_null | basic_array | basic_object
-basic_integer ::= ("0" | "-"? [1-9] [0-9]*)
-basic_number ::= ("0" | "-"? [1-9] [0-9]*) ("." [0-9]+)? ([eE] [+-]? [0-9]+)?
-basic_string ::= ["] basic_string_sub
-basic_boolean ::= "true" | "false"
-basic_null ::= "null"
-basic_array ::= ("[" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_any)* [ \n\t]* "]") | "[" [ \n\t]* "]"
+_EBNF_ANY_WHITESPACE_NON_STRICT = (
+    _BASIC_RULES
+    + r"""basic_array ::= ("[" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_any)* [ \n\t]* "]") | "[" [ \n\t]* "]"
 basic_object ::= ("{" [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any)* [ \n\t]* "}") | "{" [ \n\t]* "}"
 root_prop_1 ::= ("[" [ \n\t]* basic_integer ([ \n\t]* "," [ \n\t]* basic_integer)* [ \n\t]* "]") | "[" [ \n\t]* "]"
 root_prop_2 ::= ("{" [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_integer ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_integer)* [ \n\t]* "}") | "{" [ \n\t]* "}"
 root ::= "{" [ \n\t]* "\"value\"" [ \n\t]* ":" [ \n\t]* basic_string [ \n\t]* "," [ \n\t]* "\"arr\"" [ \n\t]* ":" [ \n\t]* root_prop_1 [ \n\t]* "," [ \n\t]* "\"obj\"" [ \n\t]* ":" [ \n\t]* root_prop_2 ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any)* [ \n\t]* "}"
 """
+)
 
-    check_schema_with_grammar(schema, ebnf_grammar, any_whitespace=True, strict_mode=False)
+
+def test_any_whitespace():
+    class SimpleModel(BaseModel):
+        value: str
+        arr: List[int]
+        obj: Dict[str, int]
+
+    schema = _dump_schema(SimpleModel.model_json_schema())
+
+    check_schema_with_grammar(schema, _EBNF_ANY_WHITESPACE, any_whitespace=True, strict_mode=True)
+
+    check_schema_with_grammar(
+        schema, _EBNF_ANY_WHITESPACE_NON_STRICT, any_whitespace=True, strict_mode=False
+    )
 
     # Test that different whitespace variations are accepted when any_whitespace=True
     instances = [
@@ -848,45 +793,51 @@ root ::= "{" [ \n\t]* "\"value\"" [ \n\t]* ":" [ \n\t]* basic_string [ \n\t]* ",
 
 
 def test_array_with_only_items_keyword():
-    schema = {
-        "items": {
-            "type": "object",
-            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-            "required": ["name", "age"],
+    schema = _dump_schema(
+        {
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                "required": ["name", "age"],
+            }
         }
-    }
+    )
     instance_accepted = [{"name": "John", "age": 30}, {"name": "Jane", "age": 25}]
     instance_rejected = [{"name": "John"}]
     check_schema_with_instance(schema, instance_accepted, any_whitespace=False)
     check_schema_with_instance(schema, instance_rejected, is_accepted=False, any_whitespace=False)
 
-    schema_prefix_items = {
-        "prefixItems": [
-            {
-                "type": "object",
-                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-                "required": ["name", "age"],
-            },
-            {
-                "type": "object",
-                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-                "required": ["name", "age"],
-            },
-        ]
-    }
+    schema_prefix_items = _dump_schema(
+        {
+            "prefixItems": [
+                {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                    "required": ["name", "age"],
+                },
+                {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                    "required": ["name", "age"],
+                },
+            ]
+        }
+    )
 
     check_schema_with_instance(schema_prefix_items, instance_accepted, any_whitespace=False)
     check_schema_with_instance(
         schema_prefix_items, instance_rejected, is_accepted=False, any_whitespace=False
     )
 
-    schema_unevaluated_items = {
-        "unevaluatedItems": {
-            "type": "object",
-            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-            "required": ["name", "age"],
+    schema_unevaluated_items = _dump_schema(
+        {
+            "unevaluatedItems": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                "required": ["name", "age"],
+            }
         }
-    }
+    )
 
     check_schema_with_instance(schema_unevaluated_items, instance_accepted, any_whitespace=False)
     check_schema_with_instance(
@@ -895,16 +846,18 @@ def test_array_with_only_items_keyword():
 
 
 def test_object_with_only_properties_keyword():
-    schema = {
-        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
-        "required": ["name", "age"],
-    }
+    schema = _dump_schema(
+        {
+            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+            "required": ["name", "age"],
+        }
+    )
     instance_accepted = {"name": "John", "age": 30}
     instance_rejected = {"name": "John"}
     check_schema_with_instance(schema, instance_accepted, any_whitespace=False)
     check_schema_with_instance(schema, instance_rejected, is_accepted=False, any_whitespace=False)
 
-    schema_additional_properties = {"additionalProperties": {"type": "string"}}
+    schema_additional_properties = _dump_schema({"additionalProperties": {"type": "string"}})
     instance_accepted = {"name": "John"}
     instance_rejected = {"name": "John", "age": 30}
 
@@ -915,7 +868,7 @@ def test_object_with_only_properties_keyword():
         schema_additional_properties, instance_rejected, is_accepted=False, any_whitespace=False
     )
 
-    schema_unevaluated_properties = {"unevaluatedProperties": {"type": "string"}}
+    schema_unevaluated_properties = _dump_schema({"unevaluatedProperties": {"type": "string"}})
 
     check_schema_with_instance(
         schema_unevaluated_properties, instance_accepted, any_whitespace=False
@@ -1,12 +1,40 @@
+import functools
 import sys
 import time
+from typing import Dict, Tuple
 
 import pytest
-from transformers import AutoTokenizer
+import torch
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
 
 import xgrammar as xgr
 from xgrammar.testing import _is_grammar_accept_string, _regex_to_ebnf
 
+# Shared by the format tests, which check many instances against the same regex
+_grammar_compiler = xgr.GrammarCompiler(xgr.TokenizerInfo([]), cache_enabled=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_regex(regex: str) -> Tuple[str, xgr.CompiledGrammar]:
+    grammar_str = _regex_to_ebnf(regex)
+    return grammar_str, _grammar_compiler.compile_grammar(grammar_str)
+
+
+def _is_regex_accept_string(regex: str, instance: str) -> bool:
+    _, compiled_grammar = _compiled_regex(regex)
+    matcher = xgr.GrammarMatcher(compiled_grammar, terminate_without_stop_token=True)
+    return matcher._debug_accept_string(instance) and matcher.is_terminated()
+
+
+@pytest.fixture(scope="module")
+def tokenizer_storage() -> (
+    Dict[str, Tuple[PreTrainedTokenizerBase, xgr.GrammarCompiler, torch.Tensor]]
+):
+    """Mapping from the tokenizer path to the huggingface tokenizer, the grammar compiler and the
+    token bitmask built for it. The bitmask needs no reset between rows, as every fill overwrites
+    it."""
+    return {}
+
 
 def test_basic():
     regex = "123"
@@ -179,6 +207,7 @@ def test_ipv4():
     assert _is_grammar_accept_string(grammar_str, "123.45.67.89")
 
 
+date_time_regex = r"^\d\d\d\d-(0[1-9]|1[0-2])-([0-2]\d|3[01])T([01]\d|2[0123]):[0-5]\d:[0-5]\d(\.\d+)?(Z|[+-]([01]\d|2[0123]):[0-5]\d)$"
 date_time_instances_accepted = [
     ("2024-05-19T14:23:45Z", True),
     ("2019-11-30T08:15:27+05:30", True),
@@ -191,21 +220,7 @@ date_time_instances_accepted = [
     ("2022-08-20T12:61:10-03:00", False),
 ]
 
-
-@pytest.mark.parametrize("instance, accepted", date_time_instances_accepted)
-def test_date_time(instance: str, accepted: bool):
-    regex = r"^\d\d\d\d-(0[1-9]|1[0-2])-([0-2]\d|3[01])T([01]\d|2[0123]):[0-5]\d:[0-5]\d(\.\d+)?(Z|[+-]([01]\d|2[0123]):[0-5]\d)$"
-    grammar_str = _regex_to_ebnf(regex)
-    expected_grammar = (
-        r"""root ::= [0-9] [0-9] [0-9] [0-9] "-" ( "0" [1-9] | "1" [0-2] ) "-" ( [0-2] [0-9] """
-        r"""| "3" [01] ) "T" ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] ":" [0-5] [0-9] """
-        r"""( "." [0-9]+ )? ( "Z" | [+-] ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] )
-"""
-    )
-    assert grammar_str == expected_grammar
-    assert _is_grammar_accept_string(grammar_str, instance) == accepted
-
-
+date_regex = r"^\d\d\d\d-(0[1-9]|1[0-2])-([0-2]\d|3[01])$"
 date_instances_accepted = [
     ("0024-05-19", True),
     ("2019-11-30", True),
@@ -214,20 +229,7 @@ date_instances_accepted = [
     ("2024-12-32", False),
 ]
 
-
-@pytest.mark.parametrize("instance, accepted", date_instances_accepted)
-def test_date(instance: str, accepted: bool):
-    regex = r"^\d\d\d\d-(0[1-9]|1[0-2])-([0-2]\d|3[01])$"
-    grammar_str = _regex_to_ebnf(regex)
-    expected_grammar = (
-        r"""root ::= [0-9] [0-9] [0-9] [0-9] "-" ( "0" [1-9] | "1" [0-2] ) "-" """
-        r"""( [0-2] [0-9] | "3" [01] )
-"""
-    )
-    assert grammar_str == expected_grammar
-    assert _is_grammar_accept_string(grammar_str, instance) == accepted
-
-
+time_regex = r"^([01]\d|2[0123]):[0-5]\d:[0-5]\d(\.\d+)?(Z|[+-]([01]\d|2[0123]):[0-5]\d)$"
 time_instances_accepted = [
     ("14:23:45Z", True),
     ("08:15:27+05:30", True),
@@ -238,20 +240,11 @@ time_instances_accepted = [
     ("12:15:10-03:60", False),
 ]
 
-
-@pytest.mark.parametrize("instance, accepted", time_instances_accepted)
-def test_time(instance: str, accepted: bool):
-    regex = r"^([01]\d|2[0123]):[0-5]\d:[0-5]\d(\.\d+)?(Z|[+-]([01]\d|2[0123]):[0-5]\d)$"
-    grammar_str = _regex_to_ebnf(regex)
-    expected_grammar = (
-        r"""root ::= ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] ":" [0-5] [0-9] """
-        r"""( "." [0-9]+ )? ( "Z" | [+-] ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] )
-"""
-    )
-    assert grammar_str == expected_grammar
-    assert _is_grammar_accept_string(grammar_str, instance) == accepted
-
-
+email_regex = (
+    r"""^([\w!#$%&'*+/=?^_`{|}~-]+(\.[\w!#$%&'*+/=?^_`{|}~-]+)*"""
+    r"""|"([\w!#$%&'*+/=?^_`{|}~\-(),:;<>@[\].]|\\")+")@(([a-z0-9]([a-z0-9-]*[a-z0-9])?\.)+"""
+    r"""[a-z0-9]([a-z0-9-]*[a-z0-9])?)$"""
+)
 email_instances_accepted = [
     ("simple@example.com", True),
     ("very.common@example.com", True),
@@ -269,16 +262,54 @@ email_instances_accepted = [
     ("user@-example.com", False),
 ]
 
+format_regexes = {
+    "date_time": date_time_regex,
+    "date": date_regex,
+    "time": time_regex,
+    "email": email_regex,
+}
 
-@pytest.mark.parametrize("instance, accepted", email_instances_accepted)
-def test_email(instance: str, accepted: bool):
-    regex = (
-        r"""^([\w!#$%&'*+/=?^_`{|}~-]+(\.[\w!#$%&'*+/=?^_`{|}~-]+)*"""
-        r"""|"([\w!#$%&'*+/=?^_`{|}~\-(),:;<>@[\].]|\\")+")@(([a-z0-9]([a-z0-9-]*[a-z0-9])?\.)+"""
-        r"""[a-z0-9]([a-z0-9-]*[a-z0-9])?)$"""
-    )
-    grammar_str = _regex_to_ebnf(regex)
-    assert _is_grammar_accept_string(grammar_str, instance) == accepted
+format_expected_grammars = {
+    "date_time": (
+        r"""root ::= [0-9] [0-9] [0-9] [0-9] "-" ( "0" [1-9] | "1" [0-2] ) "-" ( [0-2] [0-9] """
+        r"""| "3" [01] ) "T" ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] ":" [0-5] [0-9] """
+        r"""( "." [0-9]+ )? ( "Z" | [+-] ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] )
+"""
+    ),
+    "date": (
+        r"""root ::= [0-9] [0-9] [0-9] [0-9] "-" ( "0" [1-9] | "1" [0-2] ) "-" """
+        r"""( [0-2] [0-9] | "3" [01] )
+"""
+    ),
+    "time": (
+        r"""root ::= ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] ":" [0-5] [0-9] """
+        r"""( "." [0-9]+ )? ( "Z" | [+-] ( [01] [0-9] | "2" [0123] ) ":" [0-5] [0-9] )
+"""
+    ),
+}
+
+
+@pytest.mark.parametrize("format_name", format_expected_grammars)
+def test_format_grammar(format_name: str):
+    grammar_str, _ = _compiled_regex(format_regexes[format_name])
+    assert grammar_str == format_expected_grammars[format_name]
+
+
+format_instance_accepted = [
+    (format_name, instance, accepted)
+    for format_name, instances_accepted in [
+        ("date_time", date_time_instances_accepted),
+        ("date", date_instances_accepted),
+        ("time", time_instances_accepted),
+        ("email", email_instances_accepted),
+    ]
+    for instance, accepted in instances_accepted
+]
+
+
+@pytest.mark.parametrize("format_name, instance, accepted", format_instance_accepted)
+def test_format(format_name: str, instance: str, accepted: bool):
+    assert _is_regex_accept_string(format_regexes[format_name], instance) == accepted
 
 
 def test_empty_character_class():
@@ -439,29 +470,43 @@ tokenizer_path_regex_instance = [(t, *ri) for t in tokenizer_paths for ri in reg
 
 
 @pytest.mark.hf_token_required
+# Keep the rows on one pytest-xdist worker so that each tokenizer is loaded only once
+@pytest.mark.xdist_group(name="mask_generation_tokenizers")
 @pytest.mark.parametrize("tokenizer_path, regex, instance", tokenizer_path_regex_instance)
-def test_mask_generation(tokenizer_path: str, regex: str, instance: str):
+def test_mask_generation(
+    tokenizer_path: str,
+    regex: str,
+    instance: str,
+    tokenizer_storage: Dict[str, Tuple[PreTrainedTokenizerBase, xgr.GrammarCompiler, torch.Tensor]],
+):
     print(f"Tokenizer: {tokenizer_path}, regex: {regex}, instance: {instance}")
 
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
-    tokenizer_info = xgr.TokenizerInfo.from_huggingface(tokenizer)
-    grammar_compiler = xgr.GrammarCompiler(tokenizer_info, cache_enabled=False)
+    if tokenizer_path not in tokenizer_storage:
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        tokenizer_info = xgr.TokenizerInfo.from_huggingface(tokenizer)
+        tokenizer_storage[tokenizer_path] = (
+            tokenizer,
+            xgr.GrammarCompiler(tokenizer_info),
+            xgr.allocate_token_bitmask(1, tokenizer_info.vocab_size),
+        )
+    tokenizer, grammar_compiler, token_bitmask = tokenizer_storage[tokenizer_path]
 
     time_start = time.monotonic_ns()
     matcher_compiled_grammar = grammar_compiler.compile_grammar(_regex_to_ebnf(regex))
     time_end = time.monotonic_ns()
     print(f"Time for preprocessing: {(time_end - time_start) / 1e3} us")
     matcher = xgr.GrammarMatcher(matcher_compiled_grammar)
-    token_bitmask = xgr.allocate_token_bitmask(1, tokenizer_info.vocab_size)
 
-    for c in instance.encode("utf-8"):
+    instance_bytes = instance.encode("utf-8")
+    for i in range(len(instance_bytes)):
         time_start = time.monotonic_ns()
         matcher.fill_next_token_bitmask(token_bitmask)
         time_end = time.monotonic_ns()
         print(f"Time for fill_next_token_bitmask: {(time_end - time_start) / 1e3} us")
-        accepted = matcher._debug_accept_string(bytes([c]))
+        # Slicing skips the temporary list of bytes([c]); one-byte bytes objects are cached
+        accepted = matcher._debug_accept_string(instance_bytes[i : i + 1])
         assert accepted
-        print(f"Accepting {c}")
+        print(f"Accepting {instance_bytes[i]}")
 
     time_start = time.monotonic_ns()
     matcher.fill_next_token_bitmask(token_bitmask)